@@ -1,107 +1,393 @@
-import os, argparse
+import os, argparse, subprocess, hashlib, json
 import numpy as np
 import pandas as pd
-from sentence_transformers import SentenceTransformer
-from sklearn.cluster import DBSCAN
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from pathlib import Path
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+ONNX_DIR = "onnx_models"
+EMBED_CACHE_DIR = "embed_cache"
+MAX_EMBED_CHARS = 1200  # ~256 tokens, the model's window; anything longer only adds tokenizer work
 
 def load_df(csv_path: str) -> pd.DataFrame:
-    df = pd.read_csv(csv_path, dtype=str, keep_default_na=False)
+    # multithreaded Arrow parser; Arrow-backed columns keep the string kernels below vectorized.
+    # Every column is typed as string up front (like dtype=str) so Arrow doesn't re-format timestamps.
+    header = pd.read_csv(csv_path, nrows=0).columns
+    opts = pa_csv.ConvertOptions(column_types={c: pa.string() for c in header}, strings_can_be_null=False)
+    # comments contain quoted newlines; without this, any file spanning several blocks fails to parse
+    parse = pa_csv.ParseOptions(newlines_in_values=True)
+    df = pa_csv.read_csv(csv_path, parse_options=parse, convert_options=opts).to_pandas(types_mapper=pd.ArrowDtype)
     if "text" not in df.columns:
         raise SystemExit("CSV must contain a 'text' column.")
     if "like_count" in df.columns:
-        df["like_count"] = pd.to_numeric(df["like_count"], errors="coerce").fillna(0).astype(int)
-    df["text"] = df["text"].astype(str).str.replace(r"\s+", " ", regex=True).str.strip()
+        # via NumPy strings: on Arrow strings to_numeric yields NaN (not null), which fillna keeps
+        df["like_count"] = pd.to_numeric(df["like_count"].astype(str), errors="coerce").fillna(0).astype("int32")
+    df["text"] = df["text"].str.replace(r"\s+", " ", regex=True).str.strip()
     df = df[df["text"] != ""].reset_index(drop=True)
     return df
 
-def embed(texts, model_name="all-MiniLM-L6-v2", batch_size=64):
+def load_onnx(model_name: str, cache_dir: str = ONNX_DIR):
+    """Export the model to ONNX once, quantize it to INT8 and open a CPU session on it."""
+    import onnxruntime as ort
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    from transformers import AutoTokenizer
+
+    out_dir = os.path.join(cache_dir, model_name.replace("/", "__"))
+    fp32_path = os.path.join(out_dir, "model.onnx")
+    int8_path = os.path.join(out_dir, "model_int8.onnx")
+    if not os.path.exists(fp32_path):
+        hf_id = model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+        print(f"Exporting {hf_id} to ONNX (one-time) …")
+        subprocess.run(["optimum-cli", "export", "onnx", "--model", hf_id,
+                        "--task", "feature-extraction", out_dir], check=True)
+    if not os.path.exists(int8_path):
+        quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+
+    opts = ort.SessionOptions()
+    opts.intra_op_num_threads = os.cpu_count() or 1
+    sess = ort.InferenceSession(int8_path, opts, providers=["CPUExecutionProvider"])
+    return sess, AutoTokenizer.from_pretrained(out_dir)
+
+def embed_onnx(sess, tokenizer, texts, batch_size=256, max_length=256):
+    # same output as SentenceTransformer: mean-pooled over the attention mask, L2-normalized
+    input_names = {i.name for i in sess.get_inputs()}
+    # tokenize once, then batch by token length so each batch pads to a similar size
+    enc = tokenizer(list(texts), truncation=True, max_length=max_length)
+    order = np.argsort([len(ids) for ids in enc["input_ids"]], kind="stable")
+    parts = []
+    for start in range(0, len(order), batch_size):
+        idx = order[start:start + batch_size]
+        batch = tokenizer.pad({k: [enc[k][i] for i in idx] for k in enc.keys()}, return_tensors="np")
+        feed = {k: v.astype(np.int64) for k, v in batch.items() if k in input_names}
+        hidden = sess.run(None, feed)[0]
+        mask = batch["attention_mask"][..., None].astype(np.float32)
+        parts.append((hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None))
+    vec = np.concatenate(parts).astype(np.float32)[np.argsort(order)]  # back to input order
+    vec /= np.linalg.norm(vec, axis=1, keepdims=True)
+    return vec.astype(np.float16)
+
+def load_encoder(model_name="all-MiniLM-L6-v2", backend="onnx"):
+    """Returns (backend actually in use, fn(texts, batch_size) -> fp16 L2-normalized vectors)."""
+    if backend == "onnx":
+        try:
+            sess, tokenizer = load_onnx(model_name)
+        except (ImportError, OSError, subprocess.CalledProcessError) as e:
+            print(f"ONNX backend unavailable ({e}); falling back to PyTorch.")
+        else:
+            return "onnx", lambda texts, batch_size: embed_onnx(sess, tokenizer, texts, batch_size=batch_size)
+
+    import torch
+    from sentence_transformers import SentenceTransformer
+    torch.set_num_threads(os.cpu_count() or 1)
+    try:
+        torch.set_num_interop_threads(2)
+    except RuntimeError:
+        pass  # can only be set once per process, before any parallel work
     model = SentenceTransformer(model_name)
-    vec = model.encode(texts, batch_size=batch_size, normalize_embeddings=True, show_progress_bar=True)
-    return np.asarray(vec, dtype=np.float32)
+
+    def encode_torch(texts, batch_size):
+        vec = model.encode(texts, batch_size=batch_size, normalize_embeddings=True, show_progress_bar=True)
+        return np.asarray(vec, dtype=np.float16)  # half the bytes; plenty for a ~0.9 cosine cutoff
+    return "torch", encode_torch
+
+def encode(texts, model_name="all-MiniLM-L6-v2", batch_size=256, backend="onnx"):
+    _, encoder = load_encoder(model_name, backend=backend)
+    return encoder(list(texts), batch_size)
+
+def embed(texts, model_name="all-MiniLM-L6-v2", batch_size=256, backend="onnx", cache_dir=EMBED_CACHE_DIR):
+    """encode() with an on-disk cache of {blake2b(text): fp16 vector}, one .npz per model/backend.
+    Returns (vectors, backend that produced them), which differs from backend after a fallback."""
+    texts = list(texts)
+    if not texts:
+        return np.empty((0, 0), dtype=np.float16), backend
+    if not cache_dir:
+        used, encoder = load_encoder(model_name, backend=backend)
+        return encoder(texts, batch_size), used
+
+    keys = np.array([hashlib.blake2b(t.encode("utf-8"), digest_size=16).digest() for t in texts], dtype="S16")
+
+    def lookup(backend):
+        path = os.path.join(cache_dir, f"{model_name.replace('/', '__')}-{backend}.npz")
+        cached_keys, cached_vecs = np.empty(0, dtype="S16"), None
+        if os.path.exists(path):
+            with np.load(path) as z:
+                cached_keys, cached_vecs = z["keys"], z["vecs"]
+        return path, cached_keys, cached_vecs, pd.Index(cached_keys).get_indexer(keys)  # -1 = miss
+
+    # the model is only loaded when something actually needs encoding
+    cache_path, cached_keys, cached_vecs, hit = lookup(backend)
+    if (hit >= 0).all():
+        return cached_vecs[hit], backend
+    used, encoder = load_encoder(model_name, backend=backend)
+    if used != backend:
+        # fell back (e.g. ONNX -> torch): INT8 and fp32 vectors differ by ~1e-2 in cosine,
+        # too much to mix at a ~0.9 cutoff, so use the cache of the backend that really runs
+        cache_path, cached_keys, cached_vecs, hit = lookup(used)
+
+    miss = np.flatnonzero(hit < 0)
+    print(f"Embedding cache: {len(texts) - miss.size} hits, {miss.size} misses")
+    if miss.size == 0:
+        return cached_vecs[hit], used
+    new_keys, first, inv = np.unique(keys[miss], return_index=True, return_inverse=True)
+    new_vecs = encoder([texts[i] for i in miss[first]], batch_size)
+
+    vec = np.empty((len(texts), new_vecs.shape[1]), dtype=np.float16)
+    vec[miss] = new_vecs[inv.ravel()]
+    if cached_vecs is not None:
+        vec[hit >= 0] = cached_vecs[hit[hit >= 0]]
+        new_keys = np.concatenate([cached_keys, new_keys])
+        new_vecs = np.concatenate([cached_vecs, new_vecs])
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, keys=new_keys, vecs=new_vecs)
+    os.replace(tmp_path, cache_path)  # never leave a half-written cache behind
+    return vec, used
+
+def similarity_graph(emb, sim=0.88, block=4096):
+    """Sparse adjacency of all pairs with cosine similarity >= sim (emb must be L2-normalized)."""
+    # emb is stored as fp16; NumPy has no fp16 BLAS, so each tile is upcast to fp32
+    # just before its GEMM and the full matrix is never held in fp32.
+    n = len(emb)
+    rows, cols = [], []
+    for i in range(0, n, block):
+        a = np.asarray(emb[i:i + block], dtype=np.float32)
+        for j in range(0, n, block):
+            b = np.asarray(emb[j:j + block], dtype=np.float32)
+            r, c = np.nonzero(a @ b.T >= sim)
+            rows.append(r + i); cols.append(c + j)
+    rows, cols = np.concatenate(rows), np.concatenate(cols)
+    return sparse.csr_matrix((np.ones(len(rows), dtype=bool), (rows, cols)), shape=(n, n))
+
+def gpu_dbscan(emb, sim=0.88, min_samples=3):
+    """cuML DBSCAN on the GPU; returns None when RAPIDS or a usable CUDA device is missing."""
+    try:
+        import cupy as cp
+        from cuml.cluster import DBSCAN as GpuDBSCAN
+    except ImportError:
+        return None
+    try:
+        if cp.cuda.runtime.getDeviceCount() == 0:
+            return None
+        db = GpuDBSCAN(eps=1.0 - float(sim), min_samples=min_samples, metric="cosine")
+        return cp.asnumpy(db.fit_predict(cp.asarray(emb, dtype=cp.float32)))
+    except cp.cuda.runtime.CUDARuntimeError as e:
+        print(f"GPU clustering unavailable ({e}); using the CPU path.")
+        return None
+
+def dbscan_from_graph(adj, min_samples=3):
+    """DBSCAN labels from a precomputed similarity graph (see similarity_graph)."""
+    # core points have >= min_samples neighbours (self included), clusters are connected
+    # components of the core-only subgraph, and border points join the cluster of their
+    # first core neighbour.
+    labels = np.full(adj.shape[0], -1, dtype=np.int64)  # -1 = noise
+    core = np.flatnonzero(adj.getnnz(axis=1) >= min_samples)
+    if core.size == 0:
+        return labels
+    _, comp = connected_components(adj[core][:, core], directed=False)
+    labels[core] = comp
+
+    border = np.flatnonzero(labels == -1)
+    to_core = adj[border][:, core]
+    has_core = np.diff(to_core.indptr) > 0
+    first = to_core.indices[to_core.indptr[:-1][has_core]]
+    labels[border[has_core]] = comp[first]
+    return labels
 
 def cluster_dbscan(emb, sim=0.88, min_samples=3):
-    eps = 1.0 - float(sim)  # cosine distance
-    db = DBSCAN(metric="cosine", eps=eps, min_samples=min_samples, n_jobs=-1)
-    return db.fit_predict(emb)  # -1 = noise
+    labels = gpu_dbscan(emb, sim=sim, min_samples=min_samples)
+    if labels is not None:
+        return labels
+    return dbscan_from_graph(similarity_graph(emb, sim=sim), min_samples=min_samples)
+
+def cluster_sim(emb, sim, min_samples_list):
+    """Labels for each min_samples at one sim; the CPU path builds the graph once and reuses it."""
+    labels = gpu_dbscan(emb, sim=sim, min_samples=min_samples_list[0])
+    if labels is not None:
+        return [labels] + [gpu_dbscan(emb, sim=sim, min_samples=m) for m in min_samples_list[1:]]
+    adj = similarity_graph(emb, sim=sim)
+    return [dbscan_from_graph(adj, min_samples=m) for m in min_samples_list]
+
+def sweep_dbscan(emb, sims, min_samples_list, n_jobs=2):
+    """Cluster every (sim, min_samples) pair, reusing one embedding matrix.
+    Work is split by sim, so at most n_jobs similarity graphs are in memory at once."""
+    from joblib import Parallel, delayed
+    # joblib hands large arrays to its workers as read-only memmaps rather than copies
+    results = Parallel(n_jobs=min(n_jobs, len(sims)))(delayed(cluster_sim)(emb, s, min_samples_list) for s in sims)
+    return {(s, m): labs for s, per_sim in zip(sims, results) for m, labs in zip(min_samples_list, per_sim)}
+
+def compact_ids(labels) -> np.ndarray:
+    """Re-map labels to 1..K by size (largest first); noise points become their own singletons."""
+    labels = np.array(labels)
+    noise = labels == -1
+    start = labels.max() + 1
+    labels[noise] = np.arange(start, start + noise.sum())
+    _, first, inv, counts = np.unique(labels, return_index=True, return_inverse=True, return_counts=True)
+    order = np.lexsort((first, -counts))  # size desc, ties by first appearance
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return (rank[inv.ravel()] + 1).astype(np.int32)
+
+def write_csv(table: pa.Table, path: str):
+    """Write table as CSV with pandas-style minimal quoting, using Arrow kernels throughout.
+    (pyarrow.csv.write_csv quotes every string field, even with quoting_style="needed".)"""
+    lit = lambda v: pa.scalar(v, pa.large_string())
+    fields = []
+    for col in table.columns:
+        s = pc.fill_null(pc.cast(col, pa.large_string()), lit(""))
+        quoted = pc.binary_join_element_wise(lit('"'), pc.replace_substring(s, '"', '""'), lit('"'), lit(""))
+        fields.append(pc.if_else(pc.match_substring_regex(s, r'[",\r\n]'), quoted, s))
+    lines = pc.binary_join_element_wise(*fields, lit(","))  # last argument is the separator
+    lines = pc.binary_join_element_wise(lines, lit(os.linesep), lit(""))
+    lines = pa.concat_arrays(lines.chunks) if lines.num_chunks else pa.array([], pa.large_string())
+    header = ",".join(f'"{c}"' if any(ch in c for ch in '",\r\n') else c for c in table.column_names)
+    with open(path, "wb") as f:
+        f.write((header + os.linesep).encode("utf-8"))
+        if len(lines):
+            # a null-free string array's data buffer is exactly its values back to back
+            _, offsets, data = lines.buffers()
+            offsets = np.frombuffer(offsets, dtype=np.int64)[lines.offset:lines.offset + len(lines) + 1]
+            f.write(memoryview(data)[offsets[0]:offsets[-1]])
 
 def summarize(df_with_ids: pd.DataFrame) -> pd.DataFrame:
-    # add a real column once so sort_values can reference it by name
-    df = df_with_ids.copy()
-    if "like_count" in df.columns:
-        df["like_count"] = pd.to_numeric(df["like_count"], errors="coerce").fillna(0).astype(int)
-    df["text_len"] = df["text"].astype(str).str.len()
-
-    rows = []
-    for cid, g in df.groupby("cluster_id"):
-        # representative: highest-like; tie-breaker: longest
-        rep = g.sort_values(by=["like_count", "text_len"], ascending=False).iloc[0]
-        rows.append({
-            "cluster_id": int(cid),
-            "size": int(len(g)),
-            "top_likes": int(rep.get("like_count", 0)),
-            "representative": rep["text"][:300] + ("…" if len(rep["text"]) > 300 else "")
-        })
-    return pd.DataFrame(rows).sort_values(by="size", ascending=False)
+    # only the columns needed here, so the caller's frame is neither copied whole nor mutated
+    df = pd.DataFrame({
+        "cluster_id": df_with_ids["cluster_id"],
+        "text": df_with_ids["text"],
+        "text_len": df_with_ids["text"].str.len().astype(np.int32),
+    })
+    if "like_count" in df_with_ids.columns:
+        df["like_count"] = pd.to_numeric(df_with_ids["like_count"].astype(str), errors="coerce").fillna(0).astype(np.int32)
+
+    # representative: highest-like; tie-breaker: longest -> first row of each cluster after one sort
+    keys = ["cluster_id"] + (["like_count"] if "like_count" in df.columns else []) + ["text_len"]
+    df = df.sort_values(by=keys, ascending=[True] + [False] * (len(keys) - 1), kind="stable")
+    rep = df.drop_duplicates("cluster_id")
+    text = rep["text"].astype(str)
+    out = pd.DataFrame({
+        "cluster_id": rep["cluster_id"].to_numpy(),
+        "size": df["cluster_id"].value_counts().reindex(rep["cluster_id"]).to_numpy(),
+        "top_likes": rep["like_count"].to_numpy() if "like_count" in rep.columns else 0,
+        "representative": (text.str.slice(0, 300) + np.where(text.str.len() > 300, "…", "")).to_numpy(),
+    })
+    return out.sort_values(by="size", ascending=False, kind="stable")
 
 
 def main():
     ap = argparse.ArgumentParser(description="Semantic clustering of comments from CSV.")
     ap.add_argument("csv", help="Input CSV from fetch step")
     ap.add_argument("--model", default="all-MiniLM-L6-v2")
+    ap.add_argument("--backend", choices=["onnx","torch"], default="onnx",
+                    help="onnx = INT8-quantized ONNX Runtime (falls back to torch if unavailable)")
+    ap.add_argument("--cache-dir", default=EMBED_CACHE_DIR, help="Where embeddings are cached between runs")
+    ap.add_argument("--no-cache", action="store_true", help="Always re-encode every comment")
+    ap.add_argument("--reuse-embeddings", action="store_true",
+                    help="Cluster the <base>_emb.npy saved by a previous run instead of encoding again")
     ap.add_argument("--sim", type=float, default=0.88, help="Higher = tighter (0..1)")
     ap.add_argument("--min-samples", type=int, default=3)
+    ap.add_argument("--sim-sweep", type=lambda s: [float(x) for x in s.split(",")], default=None,
+                    help="Also cluster at these sims, e.g. 0.80,0.85,0.90 (written to <base>_sweep.csv)")
+    ap.add_argument("--min-samples-sweep", type=lambda s: [int(x) for x in s.split(",")], default=None,
+                    help="Also cluster at these min_samples, e.g. 2,3,5")
     ap.add_argument("--csv-base", default=None, help="Base name for outputs; defaults to input name without .csv")
+    ap.add_argument("--format", choices=["csv","parquet"], default="csv", help="Format of the clustered output")
     args = ap.parse_args()
 
+    # only reaches torch's OpenMP/MKL, which load_encoder() imports lazily; numpy/scipy's
+    # BLAS was already initialized at import time and keeps its own thread count
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ.setdefault(var, str(os.cpu_count() or 1))
+
     df = load_df(args.csv)
     if df.empty:
         print("No comments to cluster."); return
 
-    print(f"Encoding {len(df)} comments with {args.model} …")
-    emb = embed(df["text"].tolist(), model_name=args.model)
-
-    print(f"Clustering with DBSCAN (sim≥{args.sim:.2f}, min_samples={args.min_samples}) …")
-    labels = cluster_dbscan(emb, sim=args.sim, min_samples=args.min_samples)
-
     base = args.csv_base or os.path.splitext(args.csv)[0]
-    clustered_path = f"{base}_clustered.csv"
+    emb_path, meta_path = f"{base}_emb.npy", f"{base}_emb.json"
+    texts = df["text"].str.slice(0, MAX_EMBED_CHARS)
+    digest = hashlib.blake2b(digest_size=16)
+    for t in texts:
+        digest.update(t.encode("utf-8") + b"\0")
+    # what the saved vectors were built from; any difference means they're stale.
+    # "backend" records the one that actually ran, so a torch fallback never passes for ONNX.
+    meta = {"model": args.model, "backend": args.backend, "rows": len(texts), "texts": digest.hexdigest()}
+    emb = None
+    if args.reuse_embeddings and os.path.exists(emb_path) and os.path.exists(meta_path):
+        if json.loads(Path(meta_path).read_text(encoding="utf-8")) == meta:
+            print(f"Reusing embeddings from {emb_path}")
+            emb = np.load(emb_path, mmap_mode="r")
+        else:
+            print(f"{emb_path} was built from a different model, backend or input; re-encoding.")
+    if emb is None:
+        if os.path.exists(meta_path):
+            os.remove(meta_path)  # the .npy is about to change; never leave a sidecar that vouches for it
+        # encode each distinct (truncated) text once, then broadcast back to every row
+        codes, uniques = pd.factorize(texts)
+        print(f"Encoding {len(uniques)} unique comments ({len(df)} total) with {args.model} …")
+        vec, meta["backend"] = embed(list(uniques), model_name=args.model, backend=args.backend,
+                                     cache_dir=None if args.no_cache else args.cache_dir)
+        print(f"Encoded with the {meta['backend']} backend.")
+        # fp16 .npy on disk; clustering reads it back memory-mapped so only the tiles in use are paged in
+        mm = np.lib.format.open_memmap(emb_path, mode="w+", dtype=np.float16, shape=(len(codes), vec.shape[1]))
+        for start in range(0, len(codes), 65536):  # row chunks, so the N x d array never exists in RAM
+            mm[start:start + 65536] = vec[codes[start:start + 65536]]
+        mm.flush()
+        del mm, vec
+        Path(meta_path).write_text(json.dumps(meta), encoding="utf-8")
+        emb = np.load(emb_path, mmap_mode="r")
+    if args.sim_sweep or args.min_samples_sweep:
+        sims = sorted(set(args.sim_sweep or []) | {args.sim})
+        mins = sorted(set(args.min_samples_sweep or []) | {args.min_samples})
+        print(f"Sweeping DBSCAN over sim={sims} x min_samples={mins} …")
+        runs = sweep_dbscan(emb, sims, mins)
+        sweep = []
+        for (s, m), labs in runs.items():
+            sizes = np.bincount(compact_ids(labs))[1:]
+            sweep.append({"sim": s, "min_samples": m, "clusters": len(sizes),
+                          "multi": int((sizes > 1).sum()), "singletons": int((sizes == 1).sum()),
+                          "largest": int(sizes.max())})
+        sweep_path = f"{base}_sweep.csv"
+        pd.DataFrame(sweep).to_csv(sweep_path, index=False, encoding="utf-8")
+        print(f"Sweep results → {sweep_path}")
+        labels = runs[(args.sim, args.min_samples)]
+    else:
+        print(f"Clustering with DBSCAN (sim≥{args.sim:.2f}, min_samples={args.min_samples}) …")
+        labels = cluster_dbscan(emb, sim=args.sim, min_samples=args.min_samples)
+
+    clustered_path = f"{base}_clustered.{args.format}"
     summary_path = f"{base}_clusters_summary.csv"
 
-    out = df.copy()
-    # Re-map labels to 1..K (keep noise as its own singletons with unique ids)
-    # Build groups
-    groups = {}
-    next_id = 1
-    for i, lab in enumerate(labels):
-        if lab == -1:
-            groups[next_id] = [i]; next_id += 1
-        else:
-            groups.setdefault(lab, []).append(i)
-    # Sort by size desc, then assign compact ids
-    ordered = sorted(groups.values(), key=len, reverse=True)
-    id_map = {}
-    cid = 1
-    for g in ordered:
-        for idx in g: id_map[idx] = cid
-        cid += 1
-
-    out["cluster_id"] = [id_map[i] for i in range(len(out))]
-    out.to_csv(clustered_path, index=False, encoding="utf-8")
+    out = df  # df isn't needed afterwards, so add the ids in place instead of copying
+    out["cluster_id"] = compact_ids(labels)
+    for col in ("video_id", "author"):  # few distinct values, repeated on every row
+        if col in out.columns:
+            out[col] = out[col].astype("category")
+    # Arrow writers are multithreaded and skip pandas' per-cell formatting
+    table = pa.Table.from_pandas(out, preserve_index=False)
+    if args.format == "parquet":
+        pq.write_table(table, clustered_path, compression="zstd")
+    else:
+        write_csv(table, clustered_path)
 
     summary = summarize(out)
     summary.to_csv(summary_path, index=False, encoding="utf-8")
 
-    total = out["cluster_id"].nunique()
-    sizes = out.groupby("cluster_id").size().sort_values(ascending=False)
-    singletons = int((sizes == 1).sum())
+    total = len(summary)  # one summary row per cluster
+    singletons = int((summary["size"] == 1).sum())
     multis = int(total - singletons)
 
     print(f"Done. Wrote:\n  - {clustered_path}\n  - {summary_path}")
     print(f"Clusters: {total} total  |  ≥2 size: {multis}  |  singletons: {singletons}")
     print("\nTop 5 clusters:")
-    for cid, sz in sizes.head(5).items():
-        rep = summary[summary["cluster_id"] == cid]["representative"].values[0]
-        print(f"  [{int(cid)}] size={int(sz)}  rep: {rep[:100]}{'…' if len(rep)>100 else ''}")
+    top5 = summary.nlargest(5, "size")[["cluster_id", "size", "representative"]]
+    for r in top5.itertuples(index=False):
+        rep = r.representative
+        print(f"  [{r.cluster_id}] size={r.size}  rep: {rep[:100]}{'…' if len(rep)>100 else ''}")
 
 if __name__ == "__main__":
     main()
@@ -14,6 +14,8 @@ def main():
     ap.add_argument("--sim", type=float, default=0.88)
     ap.add_argument("--min-samples", type=int, default=3)
     ap.add_argument("--model", default="all-MiniLM-L6-v2")
+    ap.add_argument("--backend", choices=["onnx","torch"], default="onnx")
+    ap.add_argument("--format", choices=["csv","parquet"], default="csv")
     args = ap.parse_args()
 
     raw_csv = f"{args.base}_raw.csv"
@@ -40,7 +42,8 @@ def main():
     cluster_cmd = [
         sys.executable, "cluster_comments.py", raw_csv,
         "--csv-base", args.base, "--sim", str(args.sim), "--min-samples", str(args.min_samples),
-        "--model", args.model
+        "--model", args.model, "--backend", args.backend,
+        "--format", args.format
     ]
     print(">>> Running cluster step …")
     r2 = subprocess.run(cluster_cmd)
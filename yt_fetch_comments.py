@@ -1,27 +1,75 @@
-import os, re, json, argparse
+import os, re, json, argparse, queue, threading
 from pathlib import Path
 from urllib.parse import urlparse, parse_qs
 import pandas as pd
 from googleapiclient.discovery import build
+try:
+    import orjson  # optional: several times faster than json for state snapshots
+except ImportError:
+    orjson = None
 
 API_KEY = os.getenv("YT_API_KEY")
+_ID_RE = re.compile(r"[A-Za-z0-9_-]{11}")  # bare YouTube video id
+COLUMNS = ["video_id","comment_id","parent_id","author","like_count","published_at","updated_at","text"]
 
 def extract_video_id(inp: str) -> str:
     s = (inp or "").strip().strip('"').strip("'")
     # raw 11-char id?
-    if re.fullmatch(r"[A-Za-z0-9_-]{11}", s):
+    if _ID_RE.fullmatch(s):
         return s
     try:
         u = urlparse(s)
         if "youtu.be" in u.netloc:
             cand = u.path.strip("/").split("/")[0]
-            return cand if re.fullmatch(r"[A-Za-z0-9_-]{11}", cand) else ""
+            return cand if _ID_RE.fullmatch(cand) else ""
         qs = parse_qs(u.query)
         cand = (qs.get("v") or [""])[0]
-        return cand if re.fullmatch(r"[A-Za-z0-9_-]{11}", cand) else ""
+        return cand if _ID_RE.fullmatch(cand) else ""
     except Exception:
         return ""
 
+class StateWriter:
+    """Writes state snapshots to disk on a background thread so checkpoints don't stall fetching.
+    Each write goes to a .tmp file that is then renamed over the target, so the file is never torn."""
+    def __init__(self, path: str):
+        self.path = path
+        self.q = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, state: dict):
+        self.q.put(state)
+
+    def close(self):
+        self.q.put(None)
+        self.thread.join()
+
+    def _run(self):
+        closing = False
+        while not closing:
+            pending = [self.q.get()]
+            while True:
+                try:
+                    pending.append(self.q.get_nowait())
+                except queue.Empty:
+                    break
+            closing = None in pending
+            snaps = [s for s in pending if s is not None]
+            if snaps:
+                self._write(snaps[-1])  # older snapshots are already superseded
+
+    def _write(self, state: dict):
+        if orjson:
+            data = orjson.dumps(state)
+        else:
+            data = json.dumps(state, ensure_ascii=False).encode("utf-8")
+        tmp = f"{self.path}.tmp"
+        try:
+            Path(tmp).write_bytes(data)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"Could not save state ({e}).")
+
 def fetch_all_comments(
     video_id: str,
     order: str = "time",
@@ -32,7 +80,8 @@ def fetch_all_comments(
     resume: bool = False,
     checkpoint_interval: int = 500,
 ):
-    """Resumable, quota-safe fetcher of top-level comments (+ replies unless no_replies)."""
+    """Resumable, quota-safe fetcher of top-level comments (+ replies unless no_replies).
+    Returns {column: list of values} for the columns in COLUMNS."""
     if not API_KEY:
         raise SystemExit("Please set YT_API_KEY environment variable.")
     yt = build("youtube", "v3", developerKey=API_KEY)
@@ -57,157 +106,183 @@ def fetch_all_comments(
         except Exception as e:
             print(f"Could not read state ({e}). Starting fresh.")
 
-    def save_state():
-        if save_state_path:
-            Path(save_state_path).write_text(json.dumps(state, ensure_ascii=False, indent=2), encoding="utf-8")
+    writer = StateWriter(save_state_path) if save_state_path else None
+    try:
+        processed = set(state.get("processed_top_level", []))  # serialized back to a list on save
+
+        def save_state():
+            if writer:
+                state["processed_top_level"] = list(processed)
+                writer.submit(dict(state))  # snapshot; the writer thread serializes it
 
-    rows = []
-    total_rows = 0
-    fetched_threads = 0
+        # one list per column; DataFrame(cols) is far cheaper than one dict per row
+        cols = {c: [] for c in COLUMNS}
+        total_rows = 0
+        fetched_threads = 0
 
-    def maybe_checkpoint():
-        nonlocal total_rows
-        if save_state_path and checkpoint_interval and (total_rows % checkpoint_interval == 0):
+        def add_row(comment_id, parent_id, sn):
+            cols["video_id"].append(video_id)
+            cols["comment_id"].append(comment_id)
+            cols["parent_id"].append(parent_id)
+            cols["author"].append(sn.get("authorDisplayName",""))
+            cols["like_count"].append(sn.get("likeCount",0))
+            cols["published_at"].append(sn.get("publishedAt",""))
+            cols["updated_at"].append(sn.get("updatedAt", sn.get("publishedAt","")))
+            cols["text"].append(sn.get("textOriginal",""))
+
+        def maybe_checkpoint():
+            nonlocal total_rows
+            if save_state_path and checkpoint_interval and (total_rows % checkpoint_interval == 0):
+                save_state()
+
+        # if we paused mid-replies, finish those first
+        if state.get("current_top_id") and not no_replies:
+            top_id = state["current_top_id"]
+            reply_page = state.get("reply_page_token")
+            try:
+                while True:
+                    reply_resp = yt.comments().list(
+                        part="snippet",
+                        parentId=top_id,
+                        maxResults=100,
+                        pageToken=reply_page,
+                        textFormat="plainText",
+                    ).execute()
+                    for r in reply_resp.get("items", []) or []:
+                        rs = r["snippet"]
+                        add_row(r["id"], top_id, rs)
+                        total_rows += 1
+                        maybe_checkpoint()
+                        if max_total and total_rows >= max_total:
+                            save_state(); return cols
+                    reply_page = reply_resp.get("nextPageToken")
+                    state["reply_page_token"] = reply_page
+                    if not reply_page: break
+            except Exception as e:
+                if "quotaExceeded" in str(e):
+                    print("Quota hit while resuming replies. Saved state; returning partial results.")
+                    save_state(); return cols
+                raise
+            processed.add(top_id)
+            state["current_top_id"] = None
+            state["reply_page_token"] = None
             save_state()
 
-    # if we paused mid-replies, finish those first
-    if state.get("current_top_id") and not no_replies:
-        top_id = state["current_top_id"]
-        reply_page = state.get("reply_page_token")
-        try:
-            while True:
-                reply_resp = yt.comments().list(
-                    part="snippet",
-                    parentId=top_id,
-                    maxResults=100,
-                    pageToken=reply_page,
-                    textFormat="plainText",
-                ).execute()
-                for r in reply_resp.get("items", []) or []:
-                    rs = r["snippet"]
-                    rows.append({
-                        "video_id": video_id, "comment_id": r["id"], "parent_id": top_id,
-                        "author": rs.get("authorDisplayName",""), "like_count": rs.get("likeCount",0),
-                        "published_at": rs.get("publishedAt",""),
-                        "updated_at": rs.get("updatedAt", rs.get("publishedAt","")),
-                        "text": rs.get("textOriginal","")
-                    })
-                    total_rows += 1
-                    maybe_checkpoint()
-                    if max_total and total_rows >= max_total:
-                        save_state(); return rows
-                reply_page = reply_resp.get("nextPageToken")
-                state["reply_page_token"] = reply_page
-                if not reply_page: break
-        except Exception as e:
-            if "quotaExceeded" in str(e):
-                print("Quota hit while resuming replies. Saved state; returning partial results.")
-                save_state(); return rows
-            raise
-        state["processed_top_level"] = list(set(state.get("processed_top_level", [])) | {top_id})
-        state["current_top_id"] = None
-        state["reply_page_token"] = None
-        save_state()
-
-    page_token = state.get("page_token")
-    seen_tokens = set()
-
-    while True:
-        try:
-            resp = yt.commentThreads().list(
-                part="snippet,replies",
-                videoId=video_id,
-                maxResults=100,
-                order=order,
-                textFormat="plainText",
-                pageToken=page_token
-            ).execute()
-        except Exception as e:
-            msg = str(e)
-            if "quotaExceeded" in msg:
-                print("Daily quota hit. Saved state; returning partial results.")
-                state["page_token"] = page_token; save_state(); return rows
-            if page_token and ("processingFailure" in msg or "invalidPageToken" in msg):
-                page_token = None; continue
-            raise
-
-        items = resp.get("items", [])
-        for it in items:
-            top = it["snippet"]["topLevelComment"]; ts = top["snippet"]; top_id = top["id"]
-
-            if top_id in set(state.get("processed_top_level", [])):
-                continue
-
-            rows.append({
-                "video_id": video_id, "comment_id": top_id, "parent_id": None,
-                "author": ts.get("authorDisplayName",""), "like_count": ts.get("likeCount",0),
-                "published_at": ts.get("publishedAt",""),
-                "updated_at": ts.get("updatedAt", ts.get("publishedAt","")),
-                "text": ts.get("textOriginal","")
-            })
-            total_rows += 1; fetched_threads += 1; maybe_checkpoint()
-            if max_top_level and fetched_threads >= max_top_level:
-                state["page_token"] = resp.get("nextPageToken"); save_state(); return rows
-            if max_total and total_rows >= max_total:
-                state["page_token"] = resp.get("nextPageToken"); save_state(); return rows
-
-            if not no_replies:
-                # replies included in thread page
-                for r in it.get("replies", {}).get("comments", []) or []:
-                    rs = r["snippet"]
-                    rows.append({
-                        "video_id": video_id, "comment_id": r["id"], "parent_id": top_id,
-                        "author": rs.get("authorDisplayName",""), "like_count": rs.get("likeCount",0),
-                        "published_at": rs.get("publishedAt",""),
-                        "updated_at": rs.get("updatedAt", rs.get("publishedAt","")),
-                        "text": rs.get("textOriginal","")
-                    })
-                    total_rows += 1; maybe_checkpoint()
-                    if max_total and total_rows >= max_total:
-                        state["page_token"] = resp.get("nextPageToken"); save_state(); return rows
-
-                # full replies pagination
-                if it["snippet"].get("totalReplyCount", 0):
-                    state["current_top_id"] = top_id; state["reply_page_token"] = None; save_state()
-                    reply_page = None
-                    try:
-                        while True:
-                            reply_resp = yt.comments().list(
+        page_token = state.get("page_token")
+        seen_tokens = set()
+
+        def fetch_replies(top_ids):
+            """Page through the replies of every thread in top_ids, batching up to 50
+            comments.list calls per HTTP round-trip. Returns True if the caller should stop."""
+            nonlocal total_rows
+            if not top_ids:
+                return False
+            pending = dict.fromkeys(top_ids)  # top_id -> next reply page token
+            try:
+                while pending:
+                    ids = list(pending)
+                    for i in range(0, len(ids), 50):
+                        chunk = ids[i:i + 50]
+                        responses = {}
+                        def collect(request_id, response, exception):
+                            responses[request_id] = (response, exception)
+                        batch = yt.new_batch_http_request(callback=collect)
+                        for tid in chunk:
+                            batch.add(yt.comments().list(
                                 part="snippet",
-                                parentId=top_id,
+                                parentId=tid,
                                 maxResults=100,
-                                pageToken=reply_page,
+                                pageToken=pending[tid],
                                 textFormat="plainText",
-                            ).execute()
+                            ), request_id=tid)
+                        batch.execute()
+                        for tid in chunk:
+                            reply_resp, err = responses[tid]
+                            if err is not None:
+                                raise err
                             for r in reply_resp.get("items", []) or []:
                                 rs = r["snippet"]
-                                rows.append({
-                                    "video_id": video_id, "comment_id": r["id"], "parent_id": top_id,
-                                    "author": rs.get("authorDisplayName",""), "like_count": rs.get("likeCount",0),
-                                    "published_at": rs.get("publishedAt",""),
-                                    "updated_at": rs.get("updatedAt", rs.get("publishedAt","")),
-                                    "text": rs.get("textOriginal","")
-                                })
+                                add_row(r["id"], tid, rs)
                                 total_rows += 1; maybe_checkpoint()
                                 if max_total and total_rows >= max_total:
-                                    state["reply_page_token"] = reply_resp.get("nextPageToken"); save_state(); return rows
-                            reply_page = reply_resp.get("nextPageToken")
-                            state["reply_page_token"] = reply_page
-                            if not reply_page: break
-                    except Exception as e:
-                        if "quotaExceeded" in str(e):
-                            print("Quota hit during replies. Saved state; returning partial results.")
-                            save_state(); return rows
-                        raise
-                    state["processed_top_level"] = list(set(state.get("processed_top_level", [])) | {top_id})
-                    state["current_top_id"] = None; state["reply_page_token"] = None; save_state()
-
-        next_tok = resp.get("nextPageToken")
-        if not next_tok: break
-        if next_tok in seen_tokens: page_token = None; continue
-        seen_tokens.add(next_tok); page_token = next_tok
-
-    return rows
+                                    # unfinished threads on this page are redone on resume
+                                    state["page_token"] = page_token; save_state(); return True
+                            pending[tid] = reply_resp.get("nextPageToken")
+                            if not pending[tid]:
+                                del pending[tid]
+                                processed.add(tid)
+            except Exception as e:
+                if "quotaExceeded" in str(e):
+                    print("Quota hit during replies. Saved state; returning partial results.")
+                    state["page_token"] = page_token; save_state(); return True
+                raise
+            save_state()
+            return False
+
+        while True:
+            try:
+                resp = yt.commentThreads().list(
+                    part="snippet,replies",
+                    videoId=video_id,
+                    maxResults=100,
+                    order=order,
+                    textFormat="plainText",
+                    pageToken=page_token
+                ).execute()
+            except Exception as e:
+                msg = str(e)
+                if "quotaExceeded" in msg:
+                    print("Daily quota hit. Saved state; returning partial results.")
+                    state["page_token"] = page_token; save_state(); return cols
+                if page_token and ("processingFailure" in msg or "invalidPageToken" in msg):
+                    page_token = None; continue
+                raise
+
+            items = resp.get("items", [])
+            need_replies = []  # threads with more replies than the page carried inline
+            for it in items:
+                top = it["snippet"]["topLevelComment"]; ts = top["snippet"]; top_id = top["id"]
+
+                if top_id in processed:
+                    continue
+
+                add_row(top_id, None, ts)
+                total_rows += 1; fetched_threads += 1; maybe_checkpoint()
+                if max_top_level and fetched_threads >= max_top_level:
+                    if not fetch_replies(need_replies):
+                        state["page_token"] = resp.get("nextPageToken"); save_state()
+                    return cols
+                # threads still waiting in need_replies are only finished if this page is re-read
+                resume_tok = page_token if need_replies else resp.get("nextPageToken")
+                if max_total and total_rows >= max_total:
+                    state["page_token"] = resume_tok; save_state(); return cols
+
+                if not no_replies:
+                    # replies included in thread page
+                    inline = it.get("replies", {}).get("comments", []) or []
+                    for r in inline:
+                        rs = r["snippet"]
+                        add_row(r["id"], top_id, rs)
+                        total_rows += 1; maybe_checkpoint()
+                        if max_total and total_rows >= max_total:
+                            state["page_token"] = resume_tok; save_state(); return cols
+
+                    # full replies pagination, batched per page below
+                    if it["snippet"].get("totalReplyCount", 0) > len(inline):
+                        need_replies.append(top_id)
+
+            if fetch_replies(need_replies):
+                return cols
+
+            next_tok = resp.get("nextPageToken")
+            if not next_tok: break
+            if next_tok in seen_tokens: page_token = None; continue
+            seen_tokens.add(next_tok); page_token = next_tok
+
+        return cols
+    finally:
+        if writer:
+            writer.close()  # flush the final snapshot before returning
 
 def main():
     ap = argparse.ArgumentParser(description="Fetch all YouTube comments (with optional resume).")
@@ -227,29 +302,22 @@ def main():
         raise SystemExit(f"Could not parse a valid 11-char video ID from input: {args.video}")
     print(f"Using videoId: {vid}")
 
-    rows = fetch_all_comments(
+    cols = fetch_all_comments(
         vid, order=args.order, max_top_level=args.max_top_level,
         no_replies=args.no_replies, max_total=args.max_total,
         save_state_path=args.save_state, resume=args.resume,
         checkpoint_interval=args.checkpoint_interval,
     )
-    if not rows:
+    # Deduplicate by comment_id (in case of resumes)
+    df = pd.DataFrame(cols, columns=COLUMNS).drop_duplicates("comment_id", keep="first")
+    if df.empty:
         print("No comments found or comments disabled.")
         return
 
-    # Deduplicate by comment_id (in case of resumes)
-    seen = set(); clean = []
-    for r in rows:
-        if r["comment_id"] in seen: continue
-        seen.add(r["comment_id"]); clean.append(r)
-
-    df = pd.DataFrame(clean, columns=[
-        "video_id","comment_id","parent_id","author","like_count","published_at","updated_at","text"
-    ])
     df.to_csv(args.csv, index=False, encoding="utf-8")
-    n_top = sum(1 for r in clean if r["parent_id"] is None)
-    n_rep = len(clean) - n_top
-    print(f"Saved {len(clean)} rows → {args.csv} (top-level: {n_top}, replies: {n_rep})")
+    n_top = int(df["parent_id"].isna().sum())
+    n_rep = len(df) - n_top
+    print(f"Saved {len(df)} rows → {args.csv} (top-level: {n_top}, replies: {n_rep})")
 
 if __name__ == "__main__":
     main()